@@ -7,11 +7,20 @@ Structure: apples/{subcategory}/ subdirectories.
 
 import argparse
 import csv
-import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-from PIL import Image
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    from dataset_common import (
+        IMAGE_EXTS, fast_image_size, manifest_entry_is_current, read_manifest, write_json,
+    )
+except ImportError:  # imported as scripts.convert_to_coco
+    from .dataset_common import (
+        IMAGE_EXTS, fast_image_size, manifest_entry_is_current, read_manifest, write_json,
+    )
 
 # Subcategory mapping
 SUBCATEGORIES = ['healthy', 'scab', 'black_rot', 'cedar_apple_rust', 'background_without_leaves']
@@ -23,6 +32,20 @@ CATEGORY_ID_MAPPING = {
     'background_without_leaves': 5,
 }
 
+# (x, y, width, height, area, category_id) parsed from one CSV row
+Box = Tuple[float, float, float, float, float, int]
+# (id, image_id, category_id, x, y, width, height, area); expanded to COCO dicts in build_coco_dict()
+Annotation = Tuple[int, int, int, float, float, float, float, float]
+
+# COCO categories shared by every split (copy with list() before handing out)
+CATEGORIES = (
+    {"id": 1, "name": "healthy", "supercategory": "apple"},
+    {"id": 2, "name": "scab", "supercategory": "apple"},
+    {"id": 3, "name": "black_rot", "supercategory": "apple"},
+    {"id": 4, "name": "cedar_apple_rust", "supercategory": "apple"},
+    {"id": 5, "name": "background_without_leaves", "supercategory": "apple"},
+)
+
 
 def read_split_list(split_file: Path) -> List[str]:
     """Read image base names (without extension) from a split file."""
@@ -32,122 +55,145 @@ def read_split_list(split_file: Path) -> List[str]:
     return [line for line in lines if line]
 
 
-def image_size(image_path: Path) -> Tuple[int, int]:
-    """Return (width, height) for an image path using PIL."""
-    with Image.open(image_path) as img:
-        return img.width, img.height
-
-
-def parse_csv_boxes(csv_path: Path) -> List[Dict]:
-    """Parse a single CSV file and return bounding boxes with category IDs."""
+def parse_csv_boxes(csv_path: Path) -> List[Box]:
+    """Parse a single CSV file and return (x, y, width, height, area, category_id) boxes."""
     if not csv_path.exists():
         return []
     
     boxes = []
     with csv_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, [])
+        try:
+            ix, iy, iw, ih, ilabel = (header.index(name) for name in ('x', 'y', 'width', 'height', 'label'))
+        except ValueError:
+            return []
         for row in reader:
             try:
-                x = float(row.get('x', 0))
-                y = float(row.get('y', 0))
-                width = float(row.get('width', 0))
-                height = float(row.get('height', 0))
-                label = int(row.get('label', 1))
-                
-                if width > 0 and height > 0:
-                    boxes.append({
-                        'bbox': [x, y, width, height],
-                        'area': width * height,
-                        'category_id': label
-                    })
-            except (ValueError, KeyError):
+                x = float(row[ix])
+                y = float(row[iy])
+                width = float(row[iw])
+                height = float(row[ih])
+                label = int(row[ilabel])
+            except (ValueError, IndexError):
                 continue
+            
+            if width > 0 and height > 0:
+                boxes.append((x, y, width, height, width * height, label))
     
     return boxes
 
 
-def collect_annotations_for_split(
+def read_split_stems(
     category_root: Path,
     split: str,
     subcategories: List[str],
     variant: str = 'color',
-) -> Tuple[List[Dict], List[Dict], List[Dict]]:
-    """Collect COCO dictionaries for images, annotations, and categories.
-    Supports multiple subcategories: healthy, scab, black_rot, cedar_apple_rust.
-    Supports image variants: color, grayscale, segmented, with_augmentation, without_augmentation.
-    """
-    # Try to read from variant-specific sets file
+) -> Set[str]:
+    """Read the union of a split's stems over the variant-specific sets files."""
     image_stems = set()
     for subcat in subcategories:
-        variant_dir = category_root / subcat / variant
-        sets_dir = variant_dir / "sets"
-        split_file = sets_dir / f"{split}.txt"
+        split_file = category_root / subcat / variant / "sets" / f"{split}.txt"
         if split_file.exists():
             image_stems.update(read_split_list(split_file))
+    return image_stems
+
+
+def scan_dataset(
+    category_root: Path,
+    subcategories: List[str],
+    variant: str = 'color',
+    stems: Optional[Set[str]] = None,
+) -> Dict[str, Dict]:
+    """Scan all subcategories of a variant once.
+    Returns stem -> {path, subcategory, width, height, csv_path}, restricted to stems if given.
+    Sizes come from the organize_dataset.py manifest for images whose file stat still matches it.
+    """
+    dataset: Dict[str, Dict] = {}
+    for subcat in subcategories:
+        variant_dir = category_root / subcat / variant
+        images_dir = variant_dir / "images"
+        manifest = read_manifest(variant_dir)
+        if manifest is not None:
+            for stem, info in manifest.items():
+                if (stems is None or stem in stems) and stem not in dataset:
+                    img_path = os.path.join(images_dir, info["file_name"])
+                    current = manifest_entry_is_current(info, img_path)
+                    dataset[stem] = {
+                        "path": img_path,
+                        "subcategory": subcat,
+                        "width": info["width"] if current else None,
+                        "height": info["height"] if current else None,
+                    }
+        elif images_dir.exists():
+            with os.scandir(images_dir) as it:
+                for entry in it:
+                    stem, ext = os.path.splitext(entry.name)
+                    if (
+                        ext.lower() in IMAGE_EXTS
+                        and (stems is None or stem in stems)
+                        and stem not in dataset
+                    ):
+                        dataset[stem] = {"path": entry.path, "subcategory": subcat, "width": None}
+    
+    # Header reads are I/O-bound, so overlap them across threads
+    missing = [info for info in dataset.values() if info["width"] is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            sizes = pool.map(fast_image_size, [info["path"] for info in missing])
+            for info, (width, height) in zip(missing, sizes):
+                info["width"], info["height"] = width, height
     
-    if not image_stems:
+    for stem, info in dataset.items():
+        info["csv_path"] = category_root / info["subcategory"] / variant / 'csv' / f"{stem}.csv"
+    return dataset
+
+
+def collect_annotations_for_split(
+    category_root: Path,
+    split: str,
+    subcategories: List[str],
+    variant: str = 'color',
+    dataset: Optional[Dict[str, Dict]] = None,
+    image_stems: Optional[Set[str]] = None,
+) -> Tuple[List[Dict], List[Annotation], List[Dict]]:
+    """Collect COCO images, annotation tuples, and categories.
+    Supports multiple subcategories: healthy, scab, black_rot, cedar_apple_rust.
+    Supports image variants: color, grayscale, segmented, with_augmentation, without_augmentation.
+    Pass the results of scan_for_splits() as dataset and image_stems to reuse one scan
+    and one read of the sets files across splits.
+    """
+    if image_stems is None:
+        image_stems = read_split_stems(category_root, split, subcategories, variant)
+    if dataset is None:
+        dataset = scan_dataset(category_root, subcategories, variant, image_stems or None)
+    
+    if image_stems:
+        split_stems = sorted(image_stems.intersection(dataset))
+    else:
         # Fall back to all images from all subcategories and variant
-        image_stems = set()
-        for subcat in subcategories:
-            variant_dir = category_root / subcat / variant
-            images_dir = variant_dir / "images"
-            if images_dir.exists():
-                for ext in ['.png', '.jpg', '.JPG', '.PNG', '.jpeg', '.JPEG']:
-                    image_stems.update({p.stem for p in images_dir.glob(f"*{ext}")})
+        split_stems = sorted(dataset)
     
     images: List[Dict] = []
-    anns: List[Dict] = []
-    categories: List[Dict] = [
-        {"id": 1, "name": "healthy", "supercategory": "apple"},
-        {"id": 2, "name": "scab", "supercategory": "apple"},
-        {"id": 3, "name": "black_rot", "supercategory": "apple"},
-        {"id": 4, "name": "cedar_apple_rust", "supercategory": "apple"},
-        {"id": 5, "name": "background_without_leaves", "supercategory": "apple"},
-    ]
+    anns: List[Annotation] = []
+    categories: List[Dict] = list(CATEGORIES)
     
     image_id_counter = 1
     ann_id_counter = 1
     
-    # Search through all subcategories and variant
-    for stem in sorted(image_stems):
-        img_path = None
-        subcategory = None
-        csv_path = None
-        
-        # Try each subcategory and variant
-        for subcat in subcategories:
-            variant_dir = category_root / subcat / variant
-            for ext in ['.png', '.jpg', '.JPG', '.PNG', '.jpeg', '.JPEG']:
-                test_path = variant_dir / 'images' / f"{stem}{ext}"
-                if test_path.exists():
-                    img_path = test_path
-                    subcategory = subcat
-                    csv_path = variant_dir / 'csv' / f"{stem}.csv"
-                    break
-            if img_path:
-                break
-        
-        if not img_path:
-            continue
-        
-        width, height = image_size(img_path)
+    for stem in split_stems:
+        info = dataset[stem]
         images.append({
             "id": image_id_counter,
-            "file_name": f"apples/{subcategory}/{variant}/images/{img_path.name}",
-            "width": width,
-            "height": height,
+            "file_name": f"apples/{info['subcategory']}/{variant}/images/{os.path.basename(info['path'])}",
+            "width": info["width"],
+            "height": info["height"],
         })
         
-        if csv_path and csv_path.exists():
-            for box in parse_csv_boxes(csv_path):
-                anns.append({
-                    "id": ann_id_counter,
-                    "image_id": image_id_counter,
-                    "category_id": box['category_id'],
-                    "bbox": box['bbox'],
-                    "area": box['area'],
-                    "iscrowd": 0,
-                })
+        csv_path = info["csv_path"]
+        if csv_path.exists():
+            for x, y, box_w, box_h, area, category_id in parse_csv_boxes(csv_path):
+                anns.append((ann_id_counter, image_id_counter, category_id, x, y, box_w, box_h, area))
                 ann_id_counter += 1
         
         image_id_counter += 1
@@ -155,13 +201,31 @@ def collect_annotations_for_split(
     return images, anns, categories
 
 
+def scan_for_splits(
+    category_root: Path,
+    splits: List[str],
+    subcategories: List[str],
+    variant: str = 'color',
+) -> Tuple[Dict[str, Dict], Dict[str, Set[str]]]:
+    """Run scan_dataset() once for everything the given splits need.
+    Returns the dataset index and each split's stems read from the sets files.
+    """
+    split_stems = {split: read_split_stems(category_root, split, subcategories, variant) for split in splits}
+    # A split without sets files falls back to every image, so the scan must cover all of them
+    if all(split_stems.values()):
+        dataset = scan_dataset(category_root, subcategories, variant, set().union(*split_stems.values()))
+    else:
+        dataset = scan_dataset(category_root, subcategories, variant)
+    return dataset, split_stems
+
+
 def build_coco_dict(
     images: List[Dict],
-    anns: List[Dict],
+    anns: List[Annotation],
     categories: List[Dict],
     description: str,
 ) -> Dict:
-    """Build a complete COCO dict from components."""
+    """Build a complete COCO dict from components, expanding annotation tuples to dicts."""
     return {
         "info": {
             "year": 2025,
@@ -170,7 +234,17 @@ def build_coco_dict(
             "url": "https://www.kaggle.com/datasets/abdallahalidev/plantvillage-dataset",
         },
         "images": images,
-        "annotations": anns,
+        "annotations": [
+            {
+                "id": ann_id,
+                "image_id": image_id,
+                "category_id": category_id,
+                "bbox": [x, y, width, height],
+                "area": area,
+                "iscrowd": 0,
+            }
+            for ann_id, image_id, category_id, x, y, width, height, area in anns
+        ],
         "categories": categories,
         "licenses": [],
     }
@@ -183,20 +257,22 @@ def convert(
     splits: List[str],
     subcategories: List[str],
     variant: str = 'color',
+    pretty: bool = False,
 ) -> None:
     """Convert selected category and splits to COCO JSON files."""
     out_dir.mkdir(parents=True, exist_ok=True)
     
     category_root = root / category
+    dataset, split_stems = scan_for_splits(category_root, splits, subcategories, variant)
     
     for split in splits:
         images, anns, categories = collect_annotations_for_split(
-            category_root, split, subcategories, variant
+            category_root, split, subcategories, variant, dataset, split_stems[split]
         )
         desc = f"Plant Village Apple {category} {variant} {split} split"
         coco = build_coco_dict(images, anns, categories, desc)
         out_path = out_dir / f"{category}_{variant}_instances_{split}.json"
-        out_path.write_text(json.dumps(coco, indent=2), encoding="utf-8")
+        write_json(coco, out_path, pretty)
         print(f"Generated: {out_path} ({len(images)} images, {len(anns)} annotations)")
 
 
@@ -207,20 +283,22 @@ def convert_combined(
     splits: List[str],
     subcategories: List[str],
     variant: str = 'color',
+    pretty: bool = False,
 ) -> None:
     """Convert all subcategories combined into single COCO JSON files."""
     out_dir.mkdir(parents=True, exist_ok=True)
     
     category_root = root / category
+    dataset, split_stems = scan_for_splits(category_root, splits, subcategories, variant)
     
     for split in splits:
         images, anns, categories = collect_annotations_for_split(
-            category_root, split, subcategories, variant
+            category_root, split, subcategories, variant, dataset, split_stems[split]
         )
         desc = f"Plant Village Apple {category} {variant} combined {split} split"
         coco = build_coco_dict(images, anns, categories, desc)
         out_path = out_dir / f"combined_{variant}_instances_{split}.json"
-        out_path.write_text(json.dumps(coco, indent=2), encoding="utf-8")
+        write_json(coco, out_path, pretty)
         print(f"Generated: {out_path} ({len(images)} images, {len(anns)} annotations)")
 
 
@@ -270,6 +348,11 @@ def main():
         choices=["color", "grayscale", "segmented", "with_augmentation", "without_augmentation"],
         help="Image variant to convert (default: color)",
     )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Write indented JSON instead of compact output",
+    )
     
     args = parser.parse_args()
     
@@ -284,6 +367,7 @@ def main():
             splits=args.splits,
             subcategories=args.subcategories,
             variant=args.variant,
+            pretty=args.pretty,
         )
     else:
         convert(
@@ -293,6 +377,7 @@ def main():
             splits=args.splits,
             subcategories=args.subcategories,
             variant=args.variant,
+            pretty=args.pretty,
         )
 
 
@@ -0,0 +1,156 @@
+"""
+Helpers shared by organize_dataset.py and convert_to_coco.py:
+image size lookup, JSON input/output and the per-variant image manifest.
+"""
+
+import contextlib
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional speedup, fall back to stdlib json
+    orjson = None
+
+# Image file suffixes, compared lowercased
+IMAGE_EXTS = frozenset({'.png', '.jpg', '.jpeg'})
+
+# Per-variant stem -> {file_name, width, height, size, mtime_ns} index written by organize_dataset.py
+MANIFEST_NAME = "manifest.json"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG start-of-frame markers (SOF0-SOF15, excluding DHT, JPG and DAC)
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode: str = "w", **kwargs):
+    """Open a sibling temp file for writing and move it over path once written.
+    A failed or interrupted write leaves any existing file at path untouched.
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, mode, **kwargs) as fp:
+            yield fp
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(json_path: Path):
+    """Load a JSON file, using orjson when available."""
+    with open(json_path, "rb") as fp:
+        data = fp.read()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def write_json(obj: Dict, out_path: Path, pretty: bool = False) -> None:
+    """Write a dict to out_path as compact JSON (indented if pretty), using orjson when available.
+    The file is replaced atomically, so readers never see a partial write.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        with atomic_open(out_path, "wb") as fp:
+            fp.write(orjson.dumps(obj, option=option))
+        return
+    with atomic_open(out_path, "w", encoding="utf-8") as fp:
+        if pretty:
+            json.dump(obj, fp, indent=2)
+        else:
+            json.dump(obj, fp, separators=(",", ":"))
+
+
+def read_manifest(variant_dir: Path) -> Optional[Dict[str, Dict]]:
+    """Return the image manifest of a variant directory, or None if missing or stale.
+    The manifest is stale when files were added to or removed from images/ since it was written,
+    or when it cannot be decoded; check each entry with manifest_entry_is_current() to catch
+    images edited in place.
+    """
+    manifest_path = variant_dir / MANIFEST_NAME
+    try:
+        if manifest_path.stat().st_mtime < (variant_dir / "images").stat().st_mtime:
+            return None
+        manifest = read_json(manifest_path)
+    except (FileNotFoundError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def image_manifest_entry(image_path: Path) -> Dict:
+    """Return the manifest entry for an image: its name, size in pixels and file stat."""
+    st = os.stat(image_path)
+    width, height = fast_image_size(image_path)
+    return {
+        "file_name": os.path.basename(image_path),
+        "width": width,
+        "height": height,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def manifest_entry_is_current(entry: Dict, image_path: Path) -> bool:
+    """Return True if image_path still has the file size and mtime recorded in entry."""
+    try:
+        st = os.stat(image_path)
+    except FileNotFoundError:
+        return False
+    return entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns
+
+
+def image_size(image_path: Path) -> Tuple[int, int]:
+    """Return (width, height) for an image path using PIL."""
+    from PIL import Image  # only needed for formats fast_image_size() cannot parse
+    
+    with Image.open(image_path) as img:
+        return img.width, img.height
+
+
+def _jpeg_size(f) -> Optional[Tuple[int, int]]:
+    """Scan JPEG markers from the current position for a SOF segment."""
+    while True:
+        byte = f.read(1)
+        if byte != b"\xff":
+            return None
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue  # standalone markers carry no length
+        if marker in (0xD9, 0xDA):
+            return None  # reached EOI/SOS without a frame header
+        segment = f.read(2)
+        if len(segment) < 2:
+            return None
+        (length,) = struct.unpack(">H", segment)
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return (width, height) if width and height else None
+        f.seek(length - 2, 1)
+
+
+def fast_image_size(image_path: Path) -> Tuple[int, int]:
+    """Return (width, height) by parsing only the PNG/JPEG header.
+    Falls back to PIL for other formats or unexpected headers.
+    """
+    with open(image_path, "rb") as f:
+        head = f.read(24)
+        size = None
+        if head[:8] == PNG_SIGNATURE and head[12:16] == b"IHDR":
+            size = struct.unpack(">II", head[16:24])
+        elif head[:2] == b"\xff\xd8":
+            f.seek(2)
+            size = _jpeg_size(f)
+    if size is None:
+        return image_size(image_path)
+    return size
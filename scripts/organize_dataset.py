@@ -5,11 +5,24 @@ Supports 5 image variants: color, grayscale, segmented, with_augmentation, witho
 """
 
 import os
-import json
+import argparse
+import functools
+import multiprocessing
 import shutil
 from pathlib import Path
 from collections import defaultdict
 
+try:
+    from dataset_common import (
+        IMAGE_EXTS, MANIFEST_NAME, atomic_open, image_manifest_entry, manifest_entry_is_current, read_json,
+        read_manifest, write_json,
+    )
+except ImportError:  # imported as scripts.organize_dataset
+    from .dataset_common import (
+        IMAGE_EXTS, MANIFEST_NAME, atomic_open, image_manifest_entry, manifest_entry_is_current, read_json,
+        read_manifest, write_json,
+    )
+
 # Mapping from old subcategory names to new standardized names
 SUBCATEGORY_MAPPING = {
     'Apple___Apple_scab': 'scab',
@@ -31,34 +44,76 @@ CATEGORY_ID_MAPPING = {
 # Image variants to process
 IMAGE_VARIANTS = ['color', 'grayscale', 'segmented', 'with_augmentation', 'without_augmentation']
 
+# Header line written to every per-image CSV (files are opened with newline='' so it is
+# written as-is on every platform and an empty CSV is exactly len(CSV_HEADER) bytes)
+CSV_HEADER = '#item,x,y,width,height,label\n'
+
+
+@functools.lru_cache(maxsize=None)
+def load_json(json_file):
+    """Cached read_json().
+    Results are cached so the variants of a subcategory, which organize_subcategory()
+    runs in one process, share the without_augmentation parses; organize_subcategory()
+    clears the cache when it is done. Treat the returned dict as read-only.
+    """
+    return read_json(json_file)
+
+
+def is_up_to_date(src, dst):
+    """Return True if dst exists with the same size as src and is at least as new."""
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.stat(src)
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime >= src_stat.st_mtime
+
+
+def fast_copy(src, dst):
+    """Hardlink src to dst, falling back to a full copy where links are not possible."""
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. EXDEV across filesystems, or no hardlink support
+        shutil.copy2(src, dst)
+
 
 def json_to_csv(json_file, csv_file, category_id):
     """Convert JSON annotation to CSV format."""
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    csv_lines = ['#item,x,y,width,height,label']
-    
-    for ann in data.get('annotations', []):
-        bbox = ann['bbox']  # [x, y, width, height]
-        csv_lines.append(f"{ann['id']},{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]},{category_id}")
+    data = load_json(json_file)
     
-    with open(csv_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(csv_lines) + '\n')
+    # bbox is [x, y, width, height]; rows are streamed to a temp file without building the CSV
+    # in memory, and it only replaces csv_file once complete so the up-to-date check can trust it
+    with atomic_open(csv_file, 'w', encoding='utf-8', newline='', buffering=64 * 1024) as f:
+        f.write(CSV_HEADER)
+        f.writelines(
+            f"{ann['id']},{ann['bbox'][0]},{ann['bbox'][1]},{ann['bbox'][2]},{ann['bbox'][3]},{category_id}\n"
+            for ann in data.get('annotations', [])
+        )
 
 
-def organize_variant(root_dir, old_subcat, new_subcat, variant):
-    """Organize files for one variant of a subcategory."""
+def organize_variant(root_dir, old_subcat, new_subcat, variant, force=False):
+    """Organize files for one variant of a subcategory.
+    Outputs that are already up to date are left alone unless force is set.
+    Returns (copied images, copied JSON files, generated CSV files, up-to-date images),
+    where an image is up to date when nothing was written for it.
+    """
+    category_id = CATEGORY_ID_MAPPING[new_subcat]
+    
     # Check if data is in data/origin/ or root directory
     old_dir = Path(root_dir) / 'data' / 'origin' / old_subcat
     if not old_dir.exists():
         old_dir = Path(root_dir) / old_subcat
     if not old_dir.exists():
-        return 0, 0, 0
+        return 0, 0, 0, 0
     
     variant_dir = old_dir / variant
     if not variant_dir.exists():
-        return 0, 0, 0
+        return 0, 0, 0, 0
     
     new_variant_dir = Path(root_dir) / 'apples' / new_subcat / variant
     
@@ -69,10 +124,11 @@ def organize_variant(root_dir, old_subcat, new_subcat, variant):
     
     # Collect all image files from this variant
     image_files = {}
-    for ext in ['.JPG', '.jpg', '.png', '.PNG', '.jpeg', '.JPEG']:
-        for img_file in variant_dir.glob(f'*{ext}'):
-            stem = img_file.stem
-            image_files[stem] = img_file
+    with os.scandir(variant_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in IMAGE_EXTS and entry.is_file():
+                image_files[stem] = entry
     
     # For without_augmentation, also collect JSON files
     json_files_by_pvc = {}
@@ -87,13 +143,12 @@ def organize_variant(root_dir, old_subcat, new_subcat, variant):
             
             # Try to read pvc_filename from JSON
             try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data.get('images') and len(data['images']) > 0:
-                        pvc_filename = data['images'][0].get('pvc_filename')
-                        if pvc_filename:
-                            pvc_stem = Path(pvc_filename).stem
-                            json_files_by_pvc[pvc_stem] = json_file
+                data = load_json(json_file)
+                if data.get('images') and len(data['images']) > 0:
+                    pvc_filename = data['images'][0].get('pvc_filename')
+                    if pvc_filename:
+                        pvc_stem = Path(pvc_filename).stem
+                        json_files_by_pvc[pvc_stem] = json_file
             except Exception as e:
                 pass
     
@@ -104,29 +159,38 @@ def organize_variant(root_dir, old_subcat, new_subcat, variant):
             json_files_by_stem[stem] = json_file
             
             try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if data.get('images') and len(data['images']) > 0:
-                        pvc_filename = data['images'][0].get('pvc_filename')
-                        if pvc_filename:
-                            pvc_stem = Path(pvc_filename).stem
-                            json_files_by_pvc[pvc_stem] = json_file
+                data = load_json(json_file)
+                if data.get('images') and len(data['images']) > 0:
+                    pvc_filename = data['images'][0].get('pvc_filename')
+                    if pvc_filename:
+                        pvc_stem = Path(pvc_filename).stem
+                        json_files_by_pvc[pvc_stem] = json_file
             except Exception as e:
                 pass
     
     if not image_files:
-        return 0, 0, 0
+        return 0, 0, 0, 0
     
-    category_id = CATEGORY_ID_MAPPING[new_subcat]
+    # Reuse sizes from the previous run's manifest for images whose file stat is unchanged
+    previous_manifest = None if force else read_manifest(new_variant_dir)
+    manifest = {}
     copied_images = 0
     copied_json = 0
     generated_csv = 0
+    up_to_date = 0
     
     for stem, img_file in image_files.items():
         # Copy image
         dst_img = new_variant_dir / 'images' / img_file.name
-        shutil.copy2(img_file, dst_img)
-        copied_images += 1
+        wrote = force or not is_up_to_date(img_file, dst_img)
+        if wrote:
+            fast_copy(img_file, dst_img)
+            copied_images += 1
+        previous = previous_manifest.get(stem) if previous_manifest else None
+        if previous and previous.get('file_name') == img_file.name and manifest_entry_is_current(previous, dst_img):
+            manifest[stem] = previous
+        else:
+            manifest[stem] = image_manifest_entry(dst_img)
         
         # Find matching JSON file (try pvc_filename first, then stem)
         json_file = None
@@ -135,42 +199,73 @@ def organize_variant(root_dir, old_subcat, new_subcat, variant):
         elif stem in json_files_by_stem:
             json_file = json_files_by_stem[stem]
         
+        csv_file = new_variant_dir / 'csv' / f"{stem}.csv"
         if json_file:
             # Copy JSON with image stem as name
             dst_json = new_variant_dir / 'json' / f"{stem}.json"
-            shutil.copy2(json_file, dst_json)
-            copied_json += 1
+            json_changed = force or not is_up_to_date(json_file, dst_json)
+            if json_changed:
+                fast_copy(json_file, dst_json)
+                copied_json += 1
             
             # Generate CSV
-            csv_file = new_variant_dir / 'csv' / f"{stem}.csv"
-            json_to_csv(json_file, csv_file, category_id)
-            generated_csv += 1
-        else:
+            if json_changed or not csv_file.exists() or csv_file.stat().st_mtime < json_file.stat().st_mtime:
+                json_to_csv(json_file, csv_file, category_id)
+                generated_csv += 1
+                wrote = True
+        elif force or not csv_file.exists() or csv_file.stat().st_size != len(CSV_HEADER):
             # Create empty CSV for images without annotations
-            csv_file = new_variant_dir / 'csv' / f"{stem}.csv"
-            with open(csv_file, 'w', encoding='utf-8') as f:
-                f.write('#item,x,y,width,height,label\n')
+            with atomic_open(csv_file, 'w', encoding='utf-8', newline='') as f:
+                f.write(CSV_HEADER)
+            wrote = True
+        
+        if not wrote:
+            up_to_date += 1
+    
+    # Written last so it is newer than images/; convert_to_coco.py uses it to skip scanning
+    write_json(manifest, new_variant_dir / MANIFEST_NAME)
     
-    return copied_images, copied_json, generated_csv
+    return copied_images, copied_json, generated_csv, up_to_date
 
 
-def organize_subcategory(root_dir, old_subcat, new_subcat):
-    """Organize files for one subcategory, processing all variants."""
+def format_up_to_date(count):
+    """Return the report suffix for images skipped as up to date."""
+    return f" ({count} images already up to date)" if count else ""
+
+
+def report_subcategory(old_subcat, new_subcat, variant_results):
+    """Print per-variant and total counts of files written for one subcategory."""
     print(f"Organizing {old_subcat} -> {new_subcat}...")
     
     total_images = 0
     total_json = 0
     total_csv = 0
+    total_up_to_date = 0
     
-    for variant in IMAGE_VARIANTS:
-        images, json_files, csv_files = organize_variant(root_dir, old_subcat, new_subcat, variant)
-        if images > 0:
-            print(f"  {variant}: {images} images, {json_files} JSON files, {csv_files} CSV files")
+    for variant, (images, json_files, csv_files, up_to_date) in zip(IMAGE_VARIANTS, variant_results):
+        if images > 0 or up_to_date > 0:
+            print(f"  {variant}: {images} images, {json_files} JSON files, {csv_files} CSV files"
+                  + format_up_to_date(up_to_date))
             total_images += images
             total_json += json_files
             total_csv += csv_files
+            total_up_to_date += up_to_date
     
-    print(f"  Total: {total_images} images, {total_json} JSON files, {total_csv} CSV files")
+    print(f"  Total: {total_images} images, {total_json} JSON files, {total_csv} CSV files"
+          + format_up_to_date(total_up_to_date))
+
+
+def organize_subcategory(root_dir, old_subcat, new_subcat, force=False):
+    """Organize files for one subcategory, processing all variants.
+    Returns the per-variant counts in IMAGE_VARIANTS order.
+    """
+    try:
+        return [
+            organize_variant(root_dir, old_subcat, new_subcat, variant, force) for variant in IMAGE_VARIANTS
+        ]
+    finally:
+        # Drop this subcategory's parsed JSON before the worker moves on to the next one
+        load_json.cache_clear()
 
 
 def create_splits(root_dir):
@@ -209,15 +304,18 @@ def create_splits(root_dir):
                     stem = img_file.stem
                     filename_to_subcat[stem] = new_subcat
     
+    # Group split filenames by subcategory in a single pass
+    splits_by_subcat = defaultdict(lambda: defaultdict(list))
+    for split_name, filenames in splits.items():
+        for filename in filenames:
+            stem = Path(filename).stem
+            subcat = filename_to_subcat.get(stem)
+            if subcat is not None:
+                splits_by_subcat[subcat][split_name].append(stem)
+    
     # Create split files for each subcategory and each variant
     for new_subcat in SUBCATEGORY_MAPPING.values():
-        subcat_splits = defaultdict(list)
-        
-        for split_name, filenames in splits.items():
-            for filename in filenames:
-                stem = Path(filename).stem
-                if stem in filename_to_subcat and filename_to_subcat[stem] == new_subcat:
-                    subcat_splits[split_name].append(stem)
+        subcat_splits = splits_by_subcat[new_subcat]
         
         # Create split files for each variant
         for variant in IMAGE_VARIANTS:
@@ -256,12 +354,18 @@ def create_splits(root_dir):
                 # Try to match with color variant splits first
                 matched_splits = defaultdict(list)
                 for split_name, filenames in subcat_splits.items():
+                    if variant != 'segmented':
+                        # Direct matches only (list semantics, so repeated stems are kept)
+                        matched = [filename for filename in filenames if filename in variant_image_stems]
+                        if matched:
+                            matched_splits[split_name] = matched
+                        continue
                     for filename in filenames:
                         # Check direct match
                         if filename in variant_image_stems:
                             matched_splits[split_name].append(filename)
                         # For segmented, check mapping and add all matching variants
-                        elif variant == 'segmented' and filename in stem_mapping:
+                        elif filename in stem_mapping:
                             # Add all variants (with and without _1 suffix)
                             matched_splits[split_name].extend(stem_mapping[filename])
                 
@@ -305,14 +409,30 @@ def create_splits(root_dir):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Organize Plant Village Apple dataset to standard structure")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-copy images/JSON and regenerate CSVs even if they are up to date",
+    )
+    args = parser.parse_args()
+    
     root_dir = Path(__file__).parent.parent
     
     print("Organizing Plant Village Apple dataset...")
     print(f"Root directory: {root_dir}\n")
     
-    # Organize each subcategory (all variants)
-    for old_subcat, new_subcat in SUBCATEGORY_MAPPING.items():
-        organize_subcategory(root_dir, old_subcat, new_subcat)
+    # Organize subcategories in parallel; they touch disjoint directories, and each
+    # task keeps its variants in one process so they share the load_json() cache
+    tasks = [
+        (root_dir, old_subcat, new_subcat, args.force)
+        for old_subcat, new_subcat in SUBCATEGORY_MAPPING.items()
+    ]
+    with multiprocessing.Pool(processes=min(len(tasks), os.cpu_count() or 1)) as pool:
+        results = pool.starmap(organize_subcategory, tasks)
+    
+    for (old_subcat, new_subcat), variant_results in zip(SUBCATEGORY_MAPPING.items(), results):
+        report_subcategory(old_subcat, new_subcat, variant_results)
         print()
     
     # Create dataset splits